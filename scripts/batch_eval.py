@@ -1,5 +1,15 @@
-import subprocess
+import argparse
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+# Allow `python scripts/batch_eval.py` from the repo root to import `src.*`
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.app.ask import add_context_args, load_context, encode_queries, prepare_question, ask_llm, report_answer
+from src.generation.llm_client import LLMError
 
 patients = ["P001", "P005", "P010", "P012"]
 questions = [
@@ -9,15 +19,45 @@ questions = [
     "Is pneumonitis present?"
 ]
 
-py = sys.executable  # IMPORTANT: uses the current venv python
-
-for pid in patients:
-    for q in questions:
-        print("\n" + "="*80)
-        print("PATIENT:", pid, "| Q:", q)
-        cmd = [
-            py, "-m", "src.app.ask",
-            "--question", q,
-            "--patient_id", pid
-        ]
-        subprocess.run(cmd, check=False)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the evaluation questions in-process over several patients.")
+    add_context_args(parser)
+    parser.add_argument("--concurrency", type=int, default=4, help="Parallel LLM requests")
+    args = parser.parse_args()
+
+    # Load models, index, chunks and graph once for the whole batch
+    ctx = load_context(args)
+    ctx.defer_graph_save = True  # write the graph once at the end, not after every answer
+
+    # Encode the fixed question set in one batch and reuse it across patients
+    q_embs = encode_queries(ctx.embed_model, questions, normalize=ctx.normalize_queries)
+
+    # Retrieval + prompts first (prompts see the graph as it was at the start of the batch)
+    prepared = [
+        prepare_question(q, pid, ctx, q_emb=q_embs[qi:qi + 1])
+        for qi, q in enumerate(questions)
+        for pid in patients
+    ]
+
+    # LLM calls are network-bound: run them concurrently, then report in order
+    try:
+        with ThreadPoolExecutor(max_workers=max(args.concurrency, 1)) as pool:
+            futures = [pool.submit(ask_llm, p, ctx) for p in prepared]
+
+            for p, fut in zip(prepared, futures):
+                print("\n" + "="*80)
+                print("PATIENT:", p.patient_id, "| Q:", p.question)
+                try:
+                    raw = fut.result()
+                except (LLMError, requests.RequestException) as e:
+                    # One failed call (API error, timeout, dropped connection) should not abort the rest of the batch
+                    print(f"❌ LLM call failed: {e}")
+                    continue
+                report_answer(p, raw, ctx)
+    finally:
+        ctx.graph.flush()
+
+
+if __name__ == "__main__":
+    main()
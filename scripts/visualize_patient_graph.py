@@ -1,12 +1,47 @@
+import hashlib
 import json
+import pickle
 from pathlib import Path
 import networkx as nx
+import matplotlib
+matplotlib.use("Agg")  # headless rendering; set before pyplot to skip GUI backend probing
 import matplotlib.pyplot as plt
 
 
 GRAPH_PATH = "data/graph/patient_graph.json"
 OUT_DIR = Path("assets")
 OUT_DIR.mkdir(exist_ok=True)
+LAYOUT_CACHE_DIR = OUT_DIR / ".layout_cache"
+LAYOUT_SEED = 42
+
+COLOR_MAP = {
+    "patient": "#FFD700",
+    "diagnosis": "#FF9999",
+    "treatment": "#99CCFF",
+    "adverse": "#FFCC99",
+    "negated": "#CCCCCC",
+    "followup": "#99FF99",
+}
+
+
+def cached_spring_layout(G: nx.DiGraph, patient_id: str) -> dict:
+    """
+    spring_layout is deterministic for a fixed seed and graph, so reuse positions
+    from a previous render when the nodes and edges are unchanged.
+    """
+    key_src = json.dumps([LAYOUT_SEED, list(G.nodes()), list(G.edges())])
+    key = hashlib.sha1(key_src.encode("utf-8")).hexdigest()[:16]
+    cache_path = LAYOUT_CACHE_DIR / f"{patient_id}_{key}.pkl"
+
+    if cache_path.exists():
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+
+    pos = nx.spring_layout(G, seed=LAYOUT_SEED)
+    LAYOUT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    with open(cache_path, "wb") as f:
+        pickle.dump(pos, f)
+    return pos
 
 
 def visualize_patient(patient_id: str):
@@ -19,62 +54,56 @@ def visualize_patient(patient_id: str):
         return
 
     G = nx.DiGraph()
+    # Colors are collected while adding nodes (last type wins, like the node attribute)
+    node_colors = {}
+
+    def add_node(node: str, kind: str):
+        G.add_node(node, type=kind)
+        node_colors[node] = COLOR_MAP.get(kind, "#FFFFFF")
 
     pid_node = f"Patient {patient_id}"
-    G.add_node(pid_node, type="patient")
+    add_node(pid_node, "patient")
 
     # Diagnosis
     if patient.get("diagnosis"):
         d = patient["diagnosis"]["value"]
-        G.add_node(d, type="diagnosis")
+        add_node(d, "diagnosis")
         G.add_edge(pid_node, d, label="HAS_DIAGNOSIS")
 
     # Treatment
     if patient.get("treatment"):
         t = patient["treatment"]["value"]
-        G.add_node(t, type="treatment")
+        add_node(t, "treatment")
         G.add_edge(pid_node, t, label="RECEIVED")
 
     # Adverse events
     for ev in patient.get("adverse_events", []):
         name = f"{ev['name']} (grade {ev['grade']})"
-        G.add_node(name, type="adverse")
+        add_node(name, "adverse")
         G.add_edge(pid_node, name, label="EXPERIENCED")
 
     # Negated findings
     for neg in patient.get("negated_findings", []):
         name = f"NO {neg['name']}"
-        G.add_node(name, type="negated")
+        add_node(name, "negated")
         G.add_edge(pid_node, name, label="NEGATED")
 
     # Follow-up
     if patient.get("follow_up"):
         fu = patient["follow_up"]["value"]
-        G.add_node(fu, type="followup")
+        add_node(fu, "followup")
         G.add_edge(pid_node, fu, label="FOLLOW_UP")
 
     # Layout
-    pos = nx.spring_layout(G, seed=42)
-
-    # Colors
-    color_map = []
-    for node in G.nodes(data=True):
-        t = node[1].get("type")
-        color_map.append({
-            "patient": "#FFD700",
-            "diagnosis": "#FF9999",
-            "treatment": "#99CCFF",
-            "adverse": "#FFCC99",
-            "negated": "#CCCCCC",
-            "followup": "#99FF99",
-        }.get(t, "#FFFFFF"))
+    pos = cached_spring_layout(G, patient_id)
 
     plt.figure(figsize=(12, 8))
     nx.draw(
         G,
         pos,
         with_labels=True,
-        node_color=color_map,
+        nodelist=list(node_colors),
+        node_color=list(node_colors.values()),
         node_size=2200,
         font_size=9,
         edge_color="gray"
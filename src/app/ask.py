@@ -1,15 +1,24 @@
 from __future__ import annotations
 
 import argparse
-import json
+import functools
+import os
 import re
-from typing import List, Dict, Any, Optional
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Tuple
 
 import numpy as np
+import orjson
 import faiss
-from sentence_transformers import SentenceTransformer
 
-from src.retrieval.faiss_store import load_faiss_index
+from src.retrieval.faiss_store import (
+    alloc_search_buffers,
+    load_faiss_index,
+    search_subset,
+)
+from src.retrieval.chunk_columns import ChunkColumns, load_or_build_columns
+from src.retrieval.onnx_encoder import OnnxEncoder
+from src.retrieval.st_encoder import load_query_model
 from src.graphrag.graph_store import PatientGraph
 from src.generation.prompting import build_system_prompt
 from src.generation.llm_client import chat_completion
@@ -17,19 +26,65 @@ from src.generation.validate import validate_json_answer, ValidationError
 from src.generation.guardrails import extract_focus_term, sources_contain_term
 
 
+ONNX_QINT8_FILE = "onnx/model_qint8_avx512_vnni.onnx"
+
+
 # =========================================================
 # Utilities
 # =========================================================
 
 def read_jsonl(path: str) -> List[Dict[str, Any]]:
-    items = []
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            items.append(json.loads(line))
-    return items
+    # orjson parses bytes directly and tolerates the trailing newline
+    with open(path, "rb") as f:
+        return [orjson.loads(line) for line in f if line.strip()]
+
+
+def load_embed_model(model_name: str, backend: str = "torch", quantize: bool = False) -> Any:
+    """
+    Load the query encoder (anything with `.encode(list_of_str) -> np.ndarray`).
+    "ort" runs the ONNX export directly in ONNX Runtime (no sentence-transformers/torch import);
+    check a model with `python -m src.retrieval.onnx_encoder` first, since the index is
+    built with SentenceTransformer. Models without an ONNX export or with unsupported
+    pooling fall back to the torch backend.
+    The other backends go through SentenceTransformer; both ONNX paths prefer the
+    prebuilt int8-quantized export and fall back to the default ONNX file.
+    With the torch backend, `quantize` applies dynamic int8 quantization to the
+    Linear layers and lets torch use every CPU core; otherwise the model runs in
+    FP16 on CUDA hosts.
+    """
+    if backend == "ort":
+        for file_name in (ONNX_QINT8_FILE, "onnx/model.onnx"):
+            try:
+                return OnnxEncoder.from_pretrained(model_name, file_name=file_name)
+            except Exception as e:
+                err = e
+        print(f"❌ ONNX Runtime encoder unavailable for {model_name} ({err}); using the torch backend")
+        backend = "torch"
+
+    # Heavy imports only for the SentenceTransformer backends
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "torch" and quantize:
+        torch.set_num_threads(os.cpu_count() or 1)
+        model = SentenceTransformer(model_name, backend="torch")
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    if backend == "torch":
+        # FP16 weights when CUDA is available
+        return load_query_model(model_name)
+
+    if backend != "onnx":
+        return SentenceTransformer(model_name, backend=backend)
+
+    try:
+        return SentenceTransformer(
+            model_name,
+            backend="onnx",
+            model_kwargs={"file_name": ONNX_QINT8_FILE},
+        )
+    except Exception:
+        return SentenceTransformer(model_name, backend="onnx")
 
 
 def strip_json_fence(s: str) -> str:
@@ -44,40 +99,52 @@ def strip_json_fence(s: str) -> str:
 # Retrieval
 # =========================================================
 
+def encode_queries(
+    embed_model: Any,
+    questions: List[str],
+    normalize: bool = True,
+) -> np.ndarray:
+    """
+    Encode questions in one batch into float32 rows for inner-product search.
+    Set normalize=False when the encoder already returns unit-length vectors.
+    """
+    q_emb = np.asarray(embed_model.encode(questions), dtype=np.float32)
+    if normalize:
+        faiss.normalize_L2(q_emb)
+    return q_emb
+
+
+def _items_for_ids(items: List[Dict[str, Any]], ids: np.ndarray) -> List[Dict[str, Any]]:
+    # Drop FAISS's -1 padding with a boolean mask instead of a per-id Python check
+    return [items[i] for i in ids[ids != -1].tolist()]
+
+
 def retrieve(
     *,
-    question: str,
+    q_emb: np.ndarray,
     items: List[Dict[str, Any]],
+    cols: ChunkColumns,
     index: faiss.Index,
-    embed_model: SentenceTransformer,
     top_k: int = 5,
     patient_id: Optional[str] = None,
+    search_buffers: Optional[Tuple[np.ndarray, np.ndarray]] = None,
 ) -> List[Dict[str, Any]]:
-    q_emb = embed_model.encode([question], convert_to_numpy=True).astype(np.float32)
-    faiss.normalize_L2(q_emb)
-
+    """
+    Search with a precomputed (1, d) query embedding from `encode_queries`.
+    `search_buffers` are reused (1, top_k) FAISS output arrays; results are
+    copied out before returning.
+    """
     if patient_id is None:
-        _, ids = index.search(q_emb, top_k)
-        return [items[i] for i in ids[0].tolist() if i != -1]
+        D, I = search_buffers if search_buffers is not None else (None, None)
+        _, ids = index.search(q_emb, top_k, D=D, I=I)
+        return _items_for_ids(items, ids[0])
 
-    pid = patient_id.upper()
-    candidates = [i for i, it in enumerate(items) if str(it.get("patient_id", "")).upper() == pid]
-    if not candidates:
+    candidates = cols.rows_for_patient(patient_id)
+    if len(candidates) == 0:
         return []
 
-    cand_set = set(candidates)
-    big_k = min(len(items), max(top_k * 10, 50))
-    _, ids = index.search(q_emb, big_k)
-
-    filtered = []
-    for i in ids[0].tolist():
-        if i == -1:
-            continue
-        if i in cand_set:
-            filtered.append(items[i])
-        if len(filtered) >= top_k:
-            break
-    return filtered
+    _, ids = search_subset(index, q_emb, top_k, candidates, buffers=search_buffers)
+    return _items_for_ids(items, ids[0])
 
 
 # =========================================================
@@ -88,99 +155,146 @@ def format_graph_facts(patient_facts: Optional[dict]) -> str:
     if not patient_facts:
         return "No structured patient facts available."
 
-    lines = []
-
-    if patient_facts.get("diagnosis"):
-        lines.append(f"- Diagnosis: {patient_facts['diagnosis']['value']}")
+    pf = patient_facts
+    ae = pf.get("adverse_events") or []
+    nf = pf.get("negated_findings") or []
 
-    if patient_facts.get("treatment"):
-        lines.append(f"- Treatment: {patient_facts['treatment']['value']}")
-
-    if patient_facts.get("adverse_events"):
-        evs = ", ".join(
-            f"{e['name']} (grade {e['grade']})"
-            for e in patient_facts["adverse_events"]
-        )
-        lines.append(f"- Known adverse events: {evs}")
-
-    if patient_facts.get("negated_findings"):
-        negs = ", ".join(n["name"] for n in patient_facts["negated_findings"])
-        lines.append(f"- Known absent conditions: {negs}")
+    parts = [
+        f"- Diagnosis: {pf['diagnosis']['value']}" if pf.get("diagnosis") else None,
+        f"- Treatment: {pf['treatment']['value']}" if pf.get("treatment") else None,
+        "- Known adverse events: " + ", ".join(f"{e['name']} (grade {e['grade']})" for e in ae) if ae else None,
+        "- Known absent conditions: " + ", ".join(n["name"] for n in nf) if nf else None,
+        f"- Follow-up: {pf['follow_up']['value']}" if pf.get("follow_up") else None,
+    ]
+    return "\n".join(p for p in parts if p)
 
-    if patient_facts.get("follow_up"):
-        lines.append(f"- Follow-up: {patient_facts['follow_up']['value']}")
 
-    return "\n".join(lines)
+@functools.lru_cache(maxsize=None)
+def format_patient_graph_facts(graph: PatientGraph, patient_id: Optional[str], graph_version: int) -> str:
+    """
+    Memoized `format_graph_facts` for one patient.
+    `graph_version` is part of the cache key so updates to the graph invalidate it.
+    """
+    patient_facts = graph.graph["patients"].get(patient_id) if patient_id else None
+    return format_graph_facts(patient_facts)
 
 
 # =========================================================
-# Main
+# Context
 # =========================================================
 
-def main():
-    parser = argparse.ArgumentParser(description="Ask questions with RAG + GraphRAG.")
-    parser.add_argument("--question", type=str, required=True)
-    parser.add_argument("--patient_id", type=str, default=None)
+@dataclass
+class AskContext:
+    """
+    Everything `answer()` needs, loaded once and reusable across questions.
+    """
+    items: List[Dict[str, Any]]
+    cols: ChunkColumns
+    index: faiss.Index
+    embed_model: Any  # OnnxEncoder or SentenceTransformer
+    graph: PatientGraph
+    graph_path: str
+    top_k: int = 5
+    # (1, top_k) FAISS output arrays reused by every retrieve(); not thread-safe
+    search_buffers: Optional[Tuple[np.ndarray, np.ndarray]] = None
+    defer_graph_save: bool = False
+    normalize_queries: bool = True
+    llm_model: str = "llama-3.1-8b-instant"
+    provider: str = "groq"
+    max_tokens: int = 300
+    temperature: float = 0.2
+
+
+def add_context_args(parser: argparse.ArgumentParser) -> None:
     parser.add_argument("--top_k", type=int, default=5)
     parser.add_argument("--chunks", type=str, default="data/processed/chunks.jsonl")
     parser.add_argument("--index", type=str, default="indices/faiss/index.faiss")
+    parser.add_argument("--graph", type=str, default="data/graph/patient_graph.json")
     parser.add_argument("--embed_model", type=str, default="sentence-transformers/all-MiniLM-L6-v2")
+    parser.add_argument("--backend", type=str, default="torch", choices=["ort", "torch", "onnx", "openvino"])
+    parser.add_argument("--quantize", action="store_true", help="Dynamic int8 quantization (torch backend only)")
+    parser.add_argument("--no_normalize", action="store_true", help="Skip L2-normalizing query embeddings (encoder already normalizes)")
     parser.add_argument("--max_tokens", type=int, default=300)
     parser.add_argument("--temperature", type=float, default=0.2)
     parser.add_argument("--provider", type=str, default="groq")
     parser.add_argument("--llm_model", type=str, default="llama-3.1-8b-instant")
 
-    args = parser.parse_args()
 
-    # Load data
+def load_context(args: argparse.Namespace) -> AskContext:
     items = read_jsonl(args.chunks)
-    index = load_faiss_index(args.index)
-    embed_model = SentenceTransformer(args.embed_model)
-
-    hits = retrieve(
-        question=args.question,
+    return AskContext(
         items=items,
-        index=index,
-        embed_model=embed_model,
+        cols=load_or_build_columns(args.chunks),
+        index=load_faiss_index(args.index),
+        embed_model=load_embed_model(args.embed_model, backend=args.backend, quantize=args.quantize),
+        graph=PatientGraph.load_cached(args.graph),
+        graph_path=args.graph,
         top_k=args.top_k,
-        patient_id=args.patient_id,
+        search_buffers=alloc_search_buffers(1, args.top_k),
+        normalize_queries=not args.no_normalize,
+        llm_model=args.llm_model,
+        provider=args.provider,
+        max_tokens=args.max_tokens,
+        temperature=args.temperature,
+    )
+
+
+# =========================================================
+# Answering
+# =========================================================
+
+@dataclass
+class PreparedQuestion:
+    """
+    Retrieval + prompt for one question, ready for the LLM call.
+    `messages` is None when no call is needed (no sources, or blocked by the guardrail).
+    """
+    question: str
+    patient_id: Optional[str]
+    hits: List[Dict[str, Any]]
+    messages: Optional[List[Dict[str, str]]] = None
+    blocked_focus: Optional[str] = None
+
+
+def prepare_question(
+    question: str,
+    patient_id: Optional[str],
+    ctx: AskContext,
+    q_emb: Optional[np.ndarray] = None,
+) -> PreparedQuestion:
+    """
+    Retrieve sources, apply the focus-term guardrail and build the prompt.
+    Pass `q_emb` to reuse an embedding from `encode_queries` instead of re-encoding.
+    """
+    if q_emb is None:
+        q_emb = encode_queries(ctx.embed_model, [question], normalize=ctx.normalize_queries)
+
+    hits = retrieve(
+        q_emb=q_emb,
+        items=ctx.items,
+        cols=ctx.cols,
+        index=ctx.index,
+        top_k=ctx.top_k,
+        patient_id=patient_id,
+        search_buffers=ctx.search_buffers,
     )
 
     if not hits:
-        print("❌ No sources retrieved.")
-        return
+        return PreparedQuestion(question, patient_id, hits)
+
+    hit_texts = [h.get("text", "") for h in hits]
 
     # =========================================================
     # Guardrail: block hallucinated focus terms
     # =========================================================
-    focus = extract_focus_term(args.question)
-    if focus and not sources_contain_term(hits, focus):
-        print("\n=== GUARDRAIL ===")
-        print(f"Focus term '{focus}' not found in retrieved sources.")
-        print("Returning empty structured answer.\n")
-
-        empty = {
-            "diagnosis": {"value": None, "evidence": None},
-            "treatment": {"value": None, "evidence": None},
-            "adverse_events": [],
-            "negated_findings": [],
-            "follow_up": {"value": None, "evidence": None},
-            "other_notes": f"'{focus}' not mentioned in sources.",
-        }
-
-        print(json.dumps(empty, indent=2))
-        return
+    focus = extract_focus_term(question)
+    if focus and not sources_contain_term(hit_texts, focus):
+        return PreparedQuestion(question, patient_id, hits, blocked_focus=focus)
 
     # =========================================================
-    # GraphRAG: load patient facts
+    # GraphRAG: patient facts
     # =========================================================
-    graph = PatientGraph.load("data/graph/patient_graph.json")
-    patient_facts = (
-        graph.graph["patients"].get(args.patient_id)
-        if args.patient_id
-        else None
-    )
-    graph_context = format_graph_facts(patient_facts)
+    graph_context = format_patient_graph_facts(ctx.graph, patient_id, ctx.graph.version)
 
     # =========================================================
     # Build prompts (Graph + RAG)
@@ -188,7 +302,7 @@ def main():
     system_prompt = build_system_prompt()
 
     sources_text = "\n\n".join(
-        f"[S{i+1}] {h.get('text', '')}" for i, h in enumerate(hits)
+        f"[S{i+1}] {t}" for i, t in enumerate(hit_texts)
     )
 
     user_prompt = f"""
@@ -203,7 +317,7 @@ RETRIEVED SOURCE EXCERPTS:
 
 --------------------------------------------------
 QUESTION:
-{args.question}
+{question}
 
 IMPORTANT:
 - Use structured patient facts when relevant.
@@ -216,31 +330,72 @@ IMPORTANT:
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt},
     ]
-
-    # =========================================================
-    # LLM call
-    # =========================================================
-    answer = chat_completion(
-        messages=messages,
-        model=args.llm_model,
-        provider=args.provider,
-        max_tokens=args.max_tokens,
-        temperature=args.temperature,
+    return PreparedQuestion(question, patient_id, hits, messages=messages)
+
+
+def ask_llm(prepared: PreparedQuestion, ctx: AskContext) -> Optional[str]:
+    """
+    The only network-bound step; safe to run concurrently for several questions.
+    """
+    if prepared.messages is None:
+        return None
+
+    return chat_completion(
+        messages=prepared.messages,
+        model=ctx.llm_model,
+        provider=ctx.provider,
+        max_tokens=ctx.max_tokens,
+        temperature=ctx.temperature,
     )
 
+
+def report_answer(prepared: PreparedQuestion, raw: Optional[str], ctx: AskContext) -> Optional[Dict[str, Any]]:
+    """
+    Print the report, validate the model output and update the patient graph.
+    Returns the validated JSON (or the empty guardrail answer), or None when
+    nothing usable was produced.
+    """
+    hits = prepared.hits
+
+    if not hits:
+        print("❌ No sources retrieved.")
+        return None
+
+    if prepared.blocked_focus:
+        focus = prepared.blocked_focus
+        print("\n=== GUARDRAIL ===")
+        print(f"Focus term '{focus}' not found in retrieved sources.")
+        print("Returning empty structured answer.\n")
+
+        empty = {
+            "diagnosis": {"value": None, "evidence": None},
+            "treatment": {"value": None, "evidence": None},
+            "adverse_events": [],
+            "negated_findings": [],
+            "follow_up": {"value": None, "evidence": None},
+            "other_notes": f"'{focus}' not mentioned in sources.",
+        }
+
+        print(orjson.dumps(empty, option=orjson.OPT_INDENT_2).decode())
+        return empty
+
     print("\n=== RAW MODEL OUTPUT ===\n")
-    print(answer)
+    print(raw)
 
     print("\n=== PARSED JSON (validated) ===\n")
+    parsed = None
     try:
-        answer_clean = strip_json_fence(answer)
+        answer_clean = strip_json_fence(raw)
         parsed = validate_json_answer(answer_clean, num_sources=len(hits))
 
         # Update graph
-        graph.update_from_validated_json(args.patient_id, parsed)
-        graph.save("data/graph/patient_graph.json")
+        ctx.graph.update_from_validated_json(prepared.patient_id, parsed)
+        if ctx.defer_graph_save:
+            ctx.graph.save_deferred(ctx.graph_path)
+        else:
+            ctx.graph.save(ctx.graph_path)
 
-        print(json.dumps(parsed, indent=2))
+        print(orjson.dumps(parsed, option=orjson.OPT_INDENT_2).decode())
 
     except ValidationError as e:
         print(f"❌ Validation failed: {e}")
@@ -256,6 +411,37 @@ IMPORTANT:
         print(h.get("text", ""))
         print("-" * 80)
 
+    return parsed
+
+
+def answer(
+    question: str,
+    patient_id: Optional[str],
+    ctx: AskContext,
+    q_emb: Optional[np.ndarray] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Run retrieval + guardrail + LLM + validation for one question and print the report.
+    """
+    prepared = prepare_question(question, patient_id, ctx, q_emb=q_emb)
+    return report_answer(prepared, ask_llm(prepared, ctx), ctx)
+
+
+# =========================================================
+# Main
+# =========================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Ask questions with RAG + GraphRAG.")
+    parser.add_argument("--question", type=str, required=True)
+    parser.add_argument("--patient_id", type=str, default=None)
+    add_context_args(parser)
+
+    args = parser.parse_args()
+
+    ctx = load_context(args)
+    answer(args.question, args.patient_id, ctx)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,94 @@
+from __future__ import annotations
+import argparse
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+from tqdm import tqdm
+
+from src.retrieval.chunk_columns import load_or_build_columns
+from src.retrieval.faiss_store import (
+    INDEX_TYPES,
+    build_cosine_faiss_index,
+    build_partitioned_index,
+    clear_partitions,
+    save_faiss_index,
+    save_partitioned_index,
+)
+from src.retrieval.search import read_jsonl
+
+
+# Texts encoded per block written to the memmap
+ENCODE_BLOCK = 4096
+
+
+def embeddings_path(index_path: str) -> str:
+    return str(Path(index_path).with_name("embeddings.fp32"))
+
+
+def encode_to_memmap(
+    model: SentenceTransformer,
+    texts: List[str],
+    path: str,
+    batch_size: int = 64,
+) -> np.memmap:
+    """
+    Encode `texts` into a float32 (N, d) np.memmap at `path`, one block at a time.
+    """
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    d = model.get_sentence_embedding_dimension()
+    out = np.memmap(path, dtype=np.float32, mode="w+", shape=(len(texts), d))
+
+    for start in tqdm(range(0, len(texts), ENCODE_BLOCK), desc="Encoding"):
+        block = texts[start : start + ENCODE_BLOCK]
+        out[start : start + len(block)] = model.encode(block, batch_size=batch_size, convert_to_numpy=True)
+    out.flush()
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed chunked JSONL and build the FAISS index.")
+    parser.add_argument("--chunks", type=str, default="data/processed/chunks.jsonl")
+    parser.add_argument("--index", type=str, default="indices/faiss/index.faiss")
+    parser.add_argument("--model", type=str, default="sentence-transformers/all-MiniLM-L6-v2")
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--index_type", type=str, default="flat", choices=list(INDEX_TYPES))
+    parser.add_argument("--partition", action="store_true", help="Also write one sub-index per patient_id")
+    args = parser.parse_args()
+
+    items = read_jsonl(args.chunks)
+    model = SentenceTransformer(args.model)
+
+    # Row i of the index must stay chunk i of the JSONL (retrieval maps ids back to items).
+    # Embeddings go straight into an on-disk FP32 scratch matrix, block by block, so the
+    # full matrix is never held twice in RAM.
+    scratch_path = embeddings_path(args.index)
+    embeddings = encode_to_memmap(
+        model,
+        [it["text"] for it in items],
+        scratch_path,
+        batch_size=args.batch_size,
+    )
+
+    try:
+        # Partitions from an earlier build would map rows onto the new chunks file
+        clear_partitions(args.index)
+
+        index = build_cosine_faiss_index(embeddings, index_type=args.index_type)
+        save_faiss_index(index, args.index)
+        print(f"✅ Done. Indexed {index.ntotal} chunks into {args.index}")
+
+        if args.partition:
+            pid_rows = load_or_build_columns(args.chunks).rows_by_patient()
+            partitions = build_partitioned_index(embeddings, pid_rows, index_type=args.index_type)
+            save_partitioned_index(partitions, args.index)
+            print(f"✅ Wrote {len(partitions)} patient partitions")
+    finally:
+        # The indexes hold their own copy of the vectors: drop the scratch matrix
+        # (unmap first, an open mapping can't be deleted on Windows)
+        del embeddings
+        Path(scratch_path).unlink(missing_ok=True)
+
+if __name__ == "__main__":
+    main()
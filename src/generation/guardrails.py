@@ -1,6 +1,6 @@
 from __future__ import annotations
 import re
-from typing import List, Dict, Optional
+from typing import List, Optional
 
 STOPWORDS = {"is", "are", "was", "were", "present", "evidence", "of", "the", "a", "an", "in", "no"}
 
@@ -28,11 +28,11 @@ def extract_focus_term(question: str) -> Optional[str]:
     return None
 
 
-def sources_contain_term(hits: List[Dict], term: str) -> bool:
+def sources_contain_term(texts: List[str], term: str) -> bool:
+    """
+    `texts` are the retrieved chunk texts (extracted once by the caller).
+    """
     term = term.lower().strip()
     if not term:
         return True
-    for h in hits:
-        if term in (h.get("text", "").lower()):
-            return True
-    return False
+    return any(term in t.lower() for t in texts)
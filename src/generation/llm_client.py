@@ -8,6 +8,10 @@ class LLMError(Exception):
     pass
 
 
+# Shared session: keeps TLS connections alive across calls (and threads)
+_SESSION = requests.Session()
+
+
 def chat_completion(
     messages: List[Dict],
     model: str,
@@ -63,7 +67,7 @@ def chat_completion_groq(
         "temperature": temperature,
     }
 
-    r = requests.post(url, headers=headers, json=payload, timeout=60)
+    r = _SESSION.post(url, headers=headers, json=payload, timeout=60)
     if r.status_code != 200:
         raise LLMError(f"Groq error {r.status_code}: {r.text}")
 
@@ -102,7 +106,7 @@ def chat_completion_openrouter(
         "temperature": temperature,
     }
 
-    r = requests.post(url, headers=headers, json=payload, timeout=60)
+    r = _SESSION.post(url, headers=headers, json=payload, timeout=60)
     if r.status_code != 200:
         raise LLMError(f"OpenRouter error {r.status_code}: {r.text}")
 
@@ -1,5 +1,6 @@
 from __future__ import annotations
 import json
+import math
 import re
 from typing import Any, Dict, List, Optional
 
@@ -10,47 +11,30 @@ class ValidationError(Exception):
 
 CIT_RE = re.compile(r"\[S(\d+)\]")
 NEG_PREFIX_RE = re.compile(r"^\s*(no evidence of|no sign of|without evidence of)\s+(.+)$", re.IGNORECASE)
+NEG_PREFIXES = ("no evidence of", "no sign of", "without evidence of")
+REQUIRED_KEYS = ("diagnosis", "treatment", "adverse_events", "negated_findings", "follow_up")
+SCALAR_KEYS = ("diagnosis", "treatment", "follow_up")
+# CTCAE grades are 1-5; 0 is tolerated for "none"
+MAX_GRADE = 5
 
 
-def _fill_missing_evidence(data: dict, num_sources: int) -> dict:
-    """
-    If the model outputs a value but forgets evidence, fill it with [S1] (if available).
-    This is a pragmatic fix to keep validation strict while preventing random LLM omissions.
-    """
-    fallback = "[S1]" if num_sources >= 1 else None
-
-    # --- single objects: diagnosis / treatment / follow_up ---
-    for key in ("diagnosis", "treatment", "follow_up"):
-        obj = data.get(key)
-        if isinstance(obj, dict):
-            if obj.get("value") is not None and not obj.get("evidence"):
-                obj["evidence"] = fallback
-
-    # --- lists: negated_findings ---
-    nf = data.get("negated_findings", [])
-    if isinstance(nf, list):
-        for it in nf:
-            if isinstance(it, dict):
-                if it.get("name") is not None and not it.get("evidence"):
-                    it["evidence"] = fallback
-
-    # --- lists: adverse_events ---
-    ae = data.get("adverse_events", [])
-    if isinstance(ae, list):
-        for it in ae:
-            if isinstance(it, dict):
-                if it.get("name") is not None and not it.get("evidence"):
-                    it["evidence"] = fallback
-
-    return data
+def _match_negation(name: str) -> Optional[re.Match]:
+    # Cheap prefix test first: almost no adverse event name is a negation
+    if not name.lstrip().lower().startswith(NEG_PREFIXES):
+        return None
+    return NEG_PREFIX_RE.match(name)
 
 
 def _check_citation(ev: Any, num_sources: int) -> None:
     ev = "" if ev is None else str(ev)
-    m = CIT_RE.search(ev)
-    if not m:
-        raise ValidationError(f"Missing citation in evidence: {ev!r}")
-    s_idx = int(m.group(1))
+    # Fast path for the usual bare "[S#]"; fall back to the regex for embedded citations
+    if ev.startswith("[S") and ev.endswith("]") and ev[2:-1].isdecimal():
+        s_idx = int(ev[2:-1])
+    else:
+        m = CIT_RE.search(ev)
+        if not m:
+            raise ValidationError(f"Missing citation in evidence: {ev!r}")
+        s_idx = int(m.group(1))
     if not (1 <= s_idx <= num_sources):
         raise ValidationError(f"Citation out of range: {ev} (num_sources={num_sources})")
 
@@ -64,22 +48,43 @@ def _as_list(x: Any) -> List[Any]:
 
 
 def _to_int_or_none(x: Any) -> Optional[int]:
+    """
+    Grade as an int in [0, MAX_GRADE], else None (NaN/inf, or e.g. 1e30, which
+    would otherwise reach the graph and overflow the JSON serializer).
+    """
     if x is None:
         return None
-    if isinstance(x, (int, float)):
-        return int(x)
-    if isinstance(x, str):
+    if isinstance(x, int):
+        return int(x) if 0 <= x <= MAX_GRADE else None
+    if isinstance(x, float):
+        v = x
+    elif isinstance(x, str):
         s = x.strip()
         if s == "":
             return None
         try:
-            return int(float(s))
+            v = float(s)
         except Exception:
             return None
-    return None
+    else:
+        return None
+    if not math.isfinite(v) or not (0 <= v < MAX_GRADE + 1):
+        return None
+    return int(v)
 
 
-def _coerce_value_evidence(obj: Any, field_name: str, num_sources: int) -> Dict[str, Any]:
+def _item_evidence(it: Dict[str, Any], fallback: Optional[str], fill: bool = True) -> Any:
+    """
+    If the model outputs a name but forgets evidence, use [S1] (if available).
+    This is a pragmatic fix to keep validation strict while preventing random LLM omissions.
+    fill=False (field was not a list) keeps the missing evidence, so it is rejected.
+    """
+    if fill and it.get("name") is not None and not it.get("evidence"):
+        return fallback
+    return it.get("evidence", "[S1]")
+
+
+def _coerce_value_evidence(obj: Any, field_name: str, num_sources: int, fallback: Optional[str]) -> Dict[str, Any]:
     """
     Accept either:
       - {"value": str|null, "evidence": "[S#]"|null}
@@ -87,6 +92,9 @@ def _coerce_value_evidence(obj: Any, field_name: str, num_sources: int) -> Dict[
       - null
     """
     if isinstance(obj, dict):
+        if obj.get("value") is not None and not obj.get("evidence"):
+            obj = {**obj, "evidence": fallback}
+
         if "value" not in obj or "evidence" not in obj:
             raise ValidationError(f"{field_name} must contain 'value' and 'evidence'")
 
@@ -125,86 +133,104 @@ def _normalize_other_notes(data: Dict[str, Any]) -> None:
         data["other_notes"] = str(data["other_notes"])
 
 
-def _normalize_negated_findings(data: Dict[str, Any], num_sources: int) -> None:
-    neg = data.get("negated_findings", [])
-    neg_list = _as_list(neg)
-    out = []
-    for it in neg_list:
-        if isinstance(it, str):
-            out.append({"name": it.strip(), "evidence": "[S1]"})
-            continue
+def _normalize_negated_finding(
+    it: Any,
+    num_sources: int,
+    fallback: Optional[str],
+    fill: bool = True,
+) -> Optional[Dict[str, Any]]:
+    """
+    One negated finding -> {"name", "evidence"}, or None to drop it.
+    """
+    if isinstance(it, str):
+        return {"name": it.strip(), "evidence": "[S1]"}
 
-        if not isinstance(it, dict):
-            continue
+    if not isinstance(it, dict):
+        return None
 
-        name = str(it.get("name", "")).strip()
-        ev = it.get("evidence", "[S1]")
+    name = str(it.get("name", "")).strip()
+    ev = _item_evidence(it, fallback, fill)
 
-        m = NEG_PREFIX_RE.match(name)
-        if m:
-            name = m.group(2).strip()
+    m = _match_negation(name)
+    if m:
+        name = m.group(2).strip()
 
-        if not name:
-            continue
+    if not name:
+        return None
 
-        _check_citation(ev, num_sources)
-        out.append({"name": name, "evidence": str(ev)})
+    _check_citation(ev, num_sources)
+    return {"name": name, "evidence": str(ev)}
 
-    data["negated_findings"] = out
 
+def _validate_and_normalize(data: Any, num_sources: int) -> Dict[str, Any]:
+    """
+    Single pass over the parsed answer: evidence fallback, schema coercion,
+    negation routing and citation checks, touching each item once.
+    Citation errors are raised in field order: scalars, negated findings, adverse events.
+    """
+    if not isinstance(data, dict):
+        raise ValidationError("Model output must be a JSON object")
 
-def _move_negations_from_adverse_events(data: Dict[str, Any]) -> None:
-    adv = data.get("adverse_events", [])
-    adv_list = _as_list(adv)
-    neg = _as_list(data.get("negated_findings", []))
+    for key in REQUIRED_KEYS:
+        if key not in data:
+            raise ValidationError(f"Missing key: {key}")
+
+    fallback = "[S1]" if num_sources >= 1 else None
+
+    _normalize_other_notes(data)
+
+    for key in SCALAR_KEYS:
+        data[key] = _coerce_value_evidence(data[key], key, num_sources, fallback)
+
+    # Missing item evidence is only filled for list fields; a bare object is left
+    # as is (and fails the citation check)
+    fill_adverse = isinstance(data["adverse_events"], list)
+    fill_negated = isinstance(data["negated_findings"], list)
 
+    # adverse_events: route "No evidence of X" to negated findings, keep the rest
+    moved = []
     kept = []
-    for it in adv_list:
+    for it in _as_list(data["adverse_events"]):
         if not isinstance(it, dict):
             continue
 
         if "value" in it and "name" not in it:
             name = str(it.get("value", "")).strip()
-            ev = it.get("evidence", "[S1]")
             if name:
-                kept.append({"name": name, "grade": None, "evidence": ev})
+                kept.append((name, None, it.get("evidence", "[S1]")))
             continue
 
         name = str(it.get("name", "")).strip()
-        ev = it.get("evidence", "[S1]")
+        ev = _item_evidence(it, fallback, fill_adverse)
 
-        m = NEG_PREFIX_RE.match(name)
+        m = _match_negation(name)
         if m:
             concept = m.group(2).strip()
-            neg.append({"name": concept if concept else name, "evidence": ev})
-            continue
-
-        kept.append(it)
-
-    data["adverse_events"] = kept
-    data["negated_findings"] = neg
-
-
-def _normalize_adverse_events(data: Dict[str, Any], num_sources: int) -> None:
-    adv = data.get("adverse_events", [])
-    adv_list = _as_list(adv)
-
-    out = []
-    for it in adv_list:
-        if not isinstance(it, dict):
-            continue
-
-        name = str(it.get("name", "")).strip()
-        grade = _to_int_or_none(it.get("grade", None))
-        ev = it.get("evidence", "[S1]")
-
-        if not name:
+            moved.append({"name": concept if concept else name, "evidence": ev})
             continue
 
+        if name:
+            kept.append((name, _to_int_or_none(it.get("grade", None)), ev))
+
+    negated = []
+    for it in _as_list(data["negated_findings"]):
+        neg = _normalize_negated_finding(it, num_sources, fallback, fill_negated)
+        if neg is not None:
+            negated.append(neg)
+    # Moved items already carry their (filled or not) adverse-event evidence
+    for it in moved:
+        neg = _normalize_negated_finding(it, num_sources, fallback, fill=False)
+        if neg is not None:
+            negated.append(neg)
+
+    adverse = []
+    for name, grade, ev in kept:
         _check_citation(ev, num_sources)
-        out.append({"name": name, "grade": grade, "evidence": str(ev)})
+        adverse.append({"name": name, "grade": grade, "evidence": str(ev)})
 
-    data["adverse_events"] = out
+    data["negated_findings"] = negated
+    data["adverse_events"] = adverse
+    return data
 
 
 def validate_json_answer(text: str, num_sources: int) -> Dict[str, Any]:
@@ -213,24 +239,4 @@ def validate_json_answer(text: str, num_sources: int) -> Dict[str, Any]:
     except Exception as e:
         raise ValidationError(f"Model did not return valid JSON: {e}")
 
-    # ✅ IMPORTANT: fix missing evidence BEFORE coercion/validation
-    data = _fill_missing_evidence(data, num_sources)
-
-    for key in ["diagnosis", "treatment", "adverse_events", "negated_findings", "follow_up"]:
-        if key not in data:
-            raise ValidationError(f"Missing key: {key}")
-
-    _normalize_other_notes(data)
-
-    data["diagnosis"] = _coerce_value_evidence(data["diagnosis"], "diagnosis", num_sources)
-    data["treatment"] = _coerce_value_evidence(data["treatment"], "treatment", num_sources)
-    data["follow_up"] = _coerce_value_evidence(data["follow_up"], "follow_up", num_sources)
-
-    data["negated_findings"] = _as_list(data.get("negated_findings", []))
-    data["adverse_events"] = _as_list(data.get("adverse_events", []))
-
-    _move_negations_from_adverse_events(data)
-    _normalize_negated_findings(data, num_sources)
-    _normalize_adverse_events(data, num_sources)
-
-    return data
+    return _validate_and_normalize(data, num_sources)
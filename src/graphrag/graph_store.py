@@ -1,12 +1,28 @@
 from __future__ import annotations
-import json
+import os
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
+
+import orjson
+
+
+# resolved path -> (mtime_ns, graph); see PatientGraph.load_cached
+_graph_cache: Dict[str, Tuple[Optional[int], "PatientGraph"]] = {}
+
+
+def _mtime_ns(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
 
 
 class PatientGraph:
     def __init__(self):
         self.graph: Dict[str, Any] = {"patients": {}}
+        # Bumped on every effective change; lets callers cache derived views
+        self.version = 0
+        self._pending_save: Optional[str] = None
 
     def add_patient(self, patient_id: str):
         if patient_id not in self.graph["patients"]:
@@ -22,33 +38,73 @@ class PatientGraph:
         self.add_patient(patient_id)
 
         p = self.graph["patients"][patient_id]
+        changed = False
 
-        if data.get("diagnosis", {}).get("value"):
-            p["diagnosis"] = data["diagnosis"]
-
-        if data.get("treatment", {}).get("value"):
-            p["treatment"] = data["treatment"]
+        for key in ("diagnosis", "treatment", "follow_up"):
+            if data.get(key, {}).get("value") and p.get(key) != data[key]:
+                p[key] = data[key]
+                changed = True
 
+        # Dedup on (name, grade) / name via sets instead of list membership on dicts
+        seen_ae = {(e["name"], e.get("grade")) for e in p["adverse_events"]}
         for ev in data.get("adverse_events", []):
-            if ev not in p["adverse_events"]:
+            key = (ev["name"], ev.get("grade"))
+            if key not in seen_ae:
+                seen_ae.add(key)
                 p["adverse_events"].append(ev)
+                changed = True
 
+        seen_neg = {n["name"] for n in p["negated_findings"]}
         for neg in data.get("negated_findings", []):
-            if neg not in p["negated_findings"]:
+            if neg["name"] not in seen_neg:
+                seen_neg.add(neg["name"])
                 p["negated_findings"].append(neg)
+                changed = True
 
-        if data.get("follow_up", {}).get("value"):
-            p["follow_up"] = data["follow_up"]
+        if changed:
+            self.version += 1
 
     def save(self, path: str):
         Path(path).parent.mkdir(parents=True, exist_ok=True)
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(self.graph, f, indent=2)
+        # OPT_NON_STR_KEYS keeps json.dump's behaviour for a None patient id ("null")
+        Path(path).write_bytes(
+            orjson.dumps(self.graph, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+        )
+        # The file now mirrors this instance, so it is a valid cache entry for the path
+        _graph_cache[str(Path(path).resolve())] = (_mtime_ns(path), self)
+
+    def save_deferred(self, path: str):
+        """
+        Mark the graph to be written to `path` by the next `flush()` instead of now.
+        Batch runs use this to write the graph once instead of after every answer.
+        """
+        self._pending_save = path
+
+    def flush(self):
+        if self._pending_save:
+            self.save(self._pending_save)
+            self._pending_save = None
 
     @classmethod
     def load(cls, path: str) -> "PatientGraph":
         g = cls()
         if Path(path).exists():
-            with open(path, "r", encoding="utf-8") as f:
-                g.graph = json.load(f)
+            g.graph = orjson.loads(Path(path).read_bytes())
+        return g
+
+    @classmethod
+    def load_cached(cls, path: str) -> "PatientGraph":
+        """
+        Like `load`, but returns the same in-memory instance while the file's
+        mtime is unchanged, so repeated loads in one process skip the re-read.
+        Callers share (and may mutate) the returned graph.
+        """
+        key = str(Path(path).resolve())
+        mtime = _mtime_ns(path)
+        hit = _graph_cache.get(key)
+        if hit is not None and hit[0] == mtime:
+            return hit[1]
+
+        g = cls.load(path)
+        _graph_cache[key] = (mtime, g)
         return g
@@ -1,6 +1,10 @@
 from __future__ import annotations
+import re
 from dataclasses import dataclass
-from typing import List
+from typing import List, Tuple
+
+
+WS_RE = re.compile(r"\s+")
 
 
 @dataclass
@@ -11,22 +15,35 @@ class Chunk:
     end_char: int
 
 
+def chunk_windows(n_chars: int, chunk_size: int, overlap: int) -> List[Tuple[int, int]]:
+    """
+    (start, end) character offsets of every window, computed arithmetically:
+    window k starts at k * (chunk_size - overlap), and the last one is the first
+    that reaches n_chars.
+    """
+    step = chunk_size - overlap
+    if overlap < 0 or step <= 0:
+        raise ValueError(f"Need chunk_size > overlap >= 0 (got chunk_size={chunk_size}, overlap={overlap})")
+
+    n_windows = -(-max(n_chars - chunk_size, 0) // step) + 1  # ceil
+    return [(start, min(start + chunk_size, n_chars)) for start in range(0, n_windows * step, step)]
+
+
 def chunk_text(text: str, chunk_size: int = 900, overlap: int = 150) -> List[Chunk]:
     """
     Simple character-based chunking.
     - chunk_size and overlap are in characters.
     - robust and easy to reason about.
     """
-    text = " ".join(text.split())
+    # Collapse whitespace in one C-level pass (no intermediate list of words)
+    text = WS_RE.sub(" ", text).strip()
     if not text:
         return []
 
     chunks: List[Chunk] = []
-    start = 0
     chunk_id = 0
 
-    while start < len(text):
-        end = min(start + chunk_size, len(text))
+    for start, end in chunk_windows(len(text), chunk_size, overlap):
         chunk_str = text[start:end].strip()
 
         if chunk_str:
@@ -40,9 +57,4 @@ def chunk_text(text: str, chunk_size: int = 900, overlap: int = 150) -> List[Chu
             )
             chunk_id += 1
 
-        if end == len(text):
-            break
-
-        start = max(end - overlap, 0)
-
     return chunks
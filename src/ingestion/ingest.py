@@ -1,41 +1,55 @@
 from __future__ import annotations
 import argparse
-import json
+import contextlib
+import functools
 import os
-import re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 
+import orjson
 from tqdm import tqdm
 
-from src.ingestion.pdf_loader import read_pdf_pages
+from src.ingestion.pdf_loader import PDF_BACKENDS, read_pdf_pages_cached
 from src.ingestion.chunking import chunk_text
+from src.retrieval.chunk_columns import build_columns, columns_path, save_columns
 
 
-#PATIENT_ID_REGEX = re.compile(r"\bP\d{3}\b", re.IGNORECASE)
-PATIENT_ID_REGEX = re.compile(r"(P\d{3})", re.IGNORECASE)
+# JSONL output is accumulated in a userspace buffer and flushed with os.write at ~4 MiB
+WRITE_BUFFER_BYTES = 4 << 20
 
 
+def _next_p(s: str, start: int) -> int:
+    upper, lower = s.find("P", start), s.find("p", start)
+    if upper == -1 or lower == -1:
+        return max(upper, lower)
+    return min(upper, lower)
 
-def infer_patient_id(filename: str) -> str:
-    stem = Path(filename).stem
-    m = PATIENT_ID_REGEX.search(stem)
-    if m:
-        return m.group(1).upper()
-    return stem
 
-'''
-def infer_patient_id(filename: str) -> str:
+def find_patient_id(stem: str) -> Optional[str]:
     """
-    Try to infer patient_id from filename.
-    Expected patterns like: P012_report.pdf or report_P012.pdf
-    If not found, return the file stem.
+    First "P" or "p" followed by three digits in `stem` (same match as the regex
+    (P\\d{3}) with IGNORECASE), upper-cased; None if there is none.
     """
-    m = PATIENT_ID_REGEX.search(filename)
-    if m:
-        return m.group(0).upper()
-    return Path(filename).stem
-'''
+    i = _next_p(stem, 0)
+    while i != -1:
+        digits = stem[i + 1 : i + 4]
+        if len(digits) == 3 and digits.isdecimal():
+            return "P" + digits
+        i = _next_p(stem, i + 1)
+    return None
+
+
+def infer_patient_id_from_stem(stem: str) -> str:
+    return find_patient_id(stem) or stem
+
+
+def infer_patient_id(filename: str) -> str:
+    # Plain string slicing instead of building a Path just for .stem
+    name = os.path.basename(filename)
+    dot = name.rfind(".")
+    return infer_patient_id_from_stem(name[:dot] if dot > 0 else name)
+
 
 def make_chunk_record(
     *,
@@ -43,24 +57,70 @@ def make_chunk_record(
     patient_id: str,
     page: int,
     local_chunk_id: int,
-    global_chunk_id: int,
+    global_chunk_id: Optional[int],
     text: str,
 ) -> Dict[str, Any]:
     return {
         "chunk_id": global_chunk_id,
         "local_chunk_id": local_chunk_id,
         "doc_id": doc_id,
-        "patient_id": patient_id,
+        "patient_id": patient_id.upper(),  # stored upper-case: filters compare as-is
         "page": page,
         "text": text,
     }
 
 
+def process_pdf(
+    pdf_path: str,
+    chunk_size: int,
+    overlap: int,
+    page_workers: Optional[int] = None,
+    cache_dir: Optional[str] = None,
+    backend: str = "pdfium",
+) -> List[Dict[str, Any]]:
+    """
+    Extract and chunk one PDF into chunk records.
+    Records leave chunk_id as None: global ids are assigned by the writer so they
+    stay deterministic when documents are processed in parallel.
+    """
+    pdf = Path(pdf_path)
+    doc_id = pdf.stem
+    patient_id = infer_patient_id_from_stem(doc_id)
+
+    records = []
+    for page_obj in read_pdf_pages_cached(pdf_path, cache_dir=cache_dir, workers=page_workers, backend=backend):
+        # chunk per page (keeps page metadata correct)
+        chunks = chunk_text(page_obj.text, chunk_size=chunk_size, overlap=overlap)
+
+        for c in chunks:
+            records.append(
+                make_chunk_record(
+                    doc_id=doc_id,
+                    patient_id=patient_id,
+                    page=page_obj.page_number,
+                    local_chunk_id=c.chunk_id,
+                    global_chunk_id=None,
+                    text=c.text,
+                )
+            )
+    return records
+
+
+def _write_all(fd: int, data: bytearray) -> None:
+    # os.write may write less than asked (e.g. on signals/pipes)
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
 def ingest_pdfs(
     input_dir: str,
     output_path: str,
     chunk_size: int,
     overlap: int,
+    workers: int = 1,
+    cache_dir: Optional[str] = None,
+    backend: str = "pdfium",
 ) -> int:
     input_path = Path(input_dir)
     out_path = Path(output_path)
@@ -73,29 +133,56 @@ def ingest_pdfs(
     global_chunk_id = 0
     written = 0
 
-    with out_path.open("w", encoding="utf-8") as f:
-        for pdf in tqdm(pdf_files, desc="Ingesting PDFs"):
-            doc_id = pdf.stem
-            patient_id = infer_patient_id(pdf.name)
-
-            pages = read_pdf_pages(str(pdf))
-            for page_obj in pages:
-                # chunk per page (keeps page metadata correct)
-                chunks = chunk_text(page_obj.text, chunk_size=chunk_size, overlap=overlap)
-
-                for c in chunks:
-                    rec = make_chunk_record(
-                        doc_id=doc_id,
-                        patient_id=patient_id,
-                        page=page_obj.page_number,
-                        local_chunk_id=c.chunk_id,
-                        global_chunk_id=global_chunk_id,
-                        text=c.text,
-                    )
-                    f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    paths = [str(p) for p in pdf_files]
+
+    # Documents in parallel -> pages of each document in-process (no nested pools)
+    fn = functools.partial(
+        process_pdf,
+        chunk_size=chunk_size,
+        overlap=overlap,
+        page_workers=1 if workers > 1 else None,
+        cache_dir=cache_dir,
+        backend=backend,
+    )
+    with ProcessPoolExecutor(max_workers=workers) if workers > 1 else contextlib.nullcontext() as pool:
+        # map() yields in submission order: chunk ids match a sequential run
+        results = pool.map(fn, paths) if pool else map(fn, paths)
+
+        # Columnar metadata (row i = line i) written next to the JSONL for search-time filtering
+        columns: Dict[str, List[Any]] = {k: [] for k in ("patient_ids", "doc_ids", "pages", "chunk_ids", "offsets")}
+        pos = 0
+
+        # Raw fd + one bytearray: no file-object buffering/locking layer per write
+        fd = os.open(out_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            buf = bytearray()
+            for records in tqdm(results, total=len(paths), desc="Ingesting PDFs"):
+                for rec in records:
+                    rec["chunk_id"] = global_chunk_id
+                    line = orjson.dumps(rec, option=orjson.OPT_APPEND_NEWLINE)
+                    buf += line
+
+                    columns["patient_ids"].append(rec["patient_id"])
+                    columns["doc_ids"].append(rec["doc_id"])
+                    columns["pages"].append(rec["page"])
+                    columns["chunk_ids"].append(global_chunk_id)
+                    columns["offsets"].append(pos)
+                    pos += len(line)
+
                     global_chunk_id += 1
                     written += 1
 
+                    if len(buf) >= WRITE_BUFFER_BYTES:
+                        _write_all(fd, buf)
+                        buf.clear()
+
+            if buf:
+                _write_all(fd, buf)
+        finally:
+            os.close(fd)
+
+        save_columns(build_columns(**columns), columns_path(str(out_path)))
+
     return written
 
 
@@ -105,6 +192,10 @@ def main():
     parser.add_argument("--output", type=str, default="data/processed/chunks.jsonl", help="Output JSONL path")
     parser.add_argument("--chunk_size", type=int, default=900, help="Chunk size in characters")
     parser.add_argument("--overlap", type=int, default=150, help="Overlap in characters")
+    parser.add_argument("--workers", type=int, default=min(os.cpu_count() or 1, 4), help="Parallel PDF worker processes")
+    parser.add_argument("--cache_dir", type=str, default=".cache/pdf_text", help="Extracted-text cache for unchanged PDFs")
+    parser.add_argument("--backend", type=str, default="pdfium", choices=list(PDF_BACKENDS), help="PDF text extraction library")
+    parser.add_argument("--no_cache", action="store_true", help="Always re-extract PDF text")
     args = parser.parse_args()
 
     n = ingest_pdfs(
@@ -112,6 +203,9 @@ def main():
         output_path=args.output,
         chunk_size=args.chunk_size,
         overlap=args.overlap,
+        workers=args.workers,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        backend=args.backend,
     )
     print(f"✅ Done. Wrote {n} chunks to {args.output}")
 
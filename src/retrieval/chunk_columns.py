@@ -0,0 +1,131 @@
+from __future__ import annotations
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+import numpy as np
+import orjson
+
+
+@dataclass
+class ChunkColumns:
+    """
+    Chunk metadata as parallel arrays: row i is chunk i of the JSONL (and of the FAISS index).
+    Text stays in the JSONL and is read on demand via `offsets` (byte offset of each line).
+    """
+    patient_codes: np.ndarray  # int32 codes into patient_vocab
+    patient_vocab: np.ndarray  # distinct patient ids (upper-case)
+    doc_ids: np.ndarray
+    pages: np.ndarray
+    chunk_ids: np.ndarray
+    offsets: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def rows_for_patient(self, patient_id: str) -> np.ndarray:
+        code = np.flatnonzero(self.patient_vocab == patient_id.upper())
+        if len(code) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.flatnonzero(self.patient_codes == code[0])
+
+    def rows_by_patient(self) -> Dict[str, np.ndarray]:
+        """
+        patient_id -> its row indices (ascending), for every patient at once.
+        """
+        order = np.argsort(self.patient_codes, kind="stable")
+        bounds = np.searchsorted(self.patient_codes[order], np.arange(len(self.patient_vocab) + 1))
+        return {
+            str(pid): order[bounds[c] : bounds[c + 1]]
+            for c, pid in enumerate(self.patient_vocab)
+        }
+
+    def patient_id(self, row: int) -> str:
+        return str(self.patient_vocab[self.patient_codes[row]])
+
+
+def build_columns(
+    patient_ids: Sequence[str],
+    doc_ids: Sequence[str],
+    pages: Sequence[int],
+    chunk_ids: Sequence[int],
+    offsets: Sequence[int],
+) -> ChunkColumns:
+    # patient ids arrive upper-cased (from ingest, or from columns_from_jsonl)
+    vocab, codes = np.unique(np.asarray(patient_ids, dtype=str), return_inverse=True)
+    return ChunkColumns(
+        patient_codes=codes.astype(np.int32),
+        patient_vocab=vocab,
+        doc_ids=np.asarray(doc_ids, dtype=str),
+        pages=np.asarray(pages, dtype=np.int32),
+        chunk_ids=np.asarray(chunk_ids, dtype=np.int64),
+        offsets=np.asarray(offsets, dtype=np.int64),
+    )
+
+
+def columns_path(chunks_path: str) -> str:
+    return str(Path(chunks_path).with_suffix(".meta.npz"))
+
+
+def save_columns(cols: ChunkColumns, path: str) -> None:
+    p = Path(path)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    with p.open("wb") as f:
+        np.savez(f, **asdict(cols))
+
+
+def load_columns(path: str) -> ChunkColumns:
+    with np.load(path, allow_pickle=False) as data:
+        return ChunkColumns(**{k: data[k] for k in data.files})
+
+
+def columns_from_jsonl(chunks_path: str) -> ChunkColumns:
+    """
+    Build the columns by scanning the JSONL (for chunk files written before ingest emitted them).
+    """
+    patient_ids: List[str] = []
+    doc_ids: List[str] = []
+    pages: List[int] = []
+    chunk_ids: List[int] = []
+    offsets: List[int] = []
+
+    pos = 0
+    with open(chunks_path, "rb") as f:
+        for line in f:
+            if not line.isspace():
+                rec = orjson.loads(line)
+                # Older chunk files may hold non-upper-case ids
+                patient_ids.append(str(rec.get("patient_id", "")).upper())
+                doc_ids.append(rec.get("doc_id", ""))
+                pages.append(rec.get("page") or 0)
+                chunk_ids.append(rec.get("chunk_id", -1))
+                offsets.append(pos)
+            pos += len(line)
+
+    return build_columns(patient_ids, doc_ids, pages, chunk_ids, offsets)
+
+
+def load_or_build_columns(chunks_path: str) -> ChunkColumns:
+    """
+    Load the columns saved next to the JSONL, rebuilding (and re-saving) them when
+    missing or older than the chunks file.
+    """
+    path = Path(columns_path(chunks_path))
+    if path.exists() and path.stat().st_mtime >= Path(chunks_path).stat().st_mtime:
+        return load_columns(str(path))
+
+    cols = columns_from_jsonl(chunks_path)
+    save_columns(cols, str(path))
+    return cols
+
+
+def read_texts(chunks_path: str, offsets: Sequence[int]) -> List[str]:
+    """
+    Read the text of only the given rows (by byte offset), e.g. the final top-k.
+    """
+    texts = []
+    with open(chunks_path, "rb") as f:
+        for off in offsets:
+            f.seek(int(off))
+            texts.append(orjson.loads(f.readline())["text"])
+    return texts
@@ -1,13 +1,31 @@
 from __future__ import annotations
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Tuple
+from typing import Dict, Optional, Tuple
 import json
+import shutil
 
 import numpy as np
 import faiss
 
 
+INDEX_TYPES = ("flat", "sq_fp16", "sq8", "pq", "hnsw")
+
+# 8-bit PQ trains 256 centroids per sub-quantizer
+PQ_NBITS = 8
+PQ_MIN_TRAIN = 1 << PQ_NBITS
+
+# HNSW graph: neighbors per node, build-time and default query-time beam widths
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+# Filtered HNSW searches over at most this many rows (e.g. one patient) are scored exactly
+HNSW_EXACT_SUBSET_MAX = 4096
+
+# Index types whose search() rejects an IDSelector (subset search over-fetches instead)
+SELECTOR_UNSUPPORTED = (faiss.IndexPQ,)
+
+
 @dataclass
 class FaissArtifacts:
     index_path: Path
@@ -19,8 +37,17 @@ def save_faiss_index(index: faiss.Index, path: str) -> None:
     faiss.write_index(index, path)
 
 
-def load_faiss_index(path: str) -> faiss.Index:
-    return faiss.read_index(path)
+def load_faiss_index(path: str, mmap: bool = True) -> faiss.Index:
+    """
+    With mmap=True the vectors are memory-mapped read-only instead of copied into RAM:
+    pages load lazily and stay in the OS page cache across short-lived processes.
+    IO_FLAG_MMAP covers IVF lists; IO_FLAG_MMAP_IFC (newer FAISS) covers flat/SQ/PQ codes.
+    The returned index cannot be modified.
+    """
+    if not mmap:
+        return faiss.read_index(path)
+    flags = faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY
+    return faiss.read_index(path, flags)
 
 
 def save_metadata(metadata: dict, path: str) -> None:
@@ -34,16 +61,224 @@ def load_metadata(path: str) -> dict:
         return json.load(f)
 
 
-def build_cosine_faiss_index(embeddings: np.ndarray) -> faiss.Index:
+def build_cosine_faiss_index(embeddings: np.ndarray, index_type: str = "flat") -> faiss.Index:
     """
     Build a FAISS index for cosine similarity using inner product.
-    We L2-normalize embeddings first, then cosine(u,v)=u·v.
+    We L2-normalize embeddings first (in place), then cosine(u,v)=u·v.
+
+    index_type:
+    - "flat":    exact search over FP32 vectors (IndexFlatIP).
+    - "sq_fp16": vectors stored as FP16 codes (IndexScalarQuantizer), half the memory
+                 and bandwidth with no measurable recall loss on unit vectors.
+    - "sq8":     8-bit codes per dimension (4x smaller than FP32), small recall loss.
+    - "pq":      product quantization, d/4 sub-vectors of 8 bits (16x smaller than FP32;
+                 96 bytes per 384-d vector). Lossier, and needs >= 256 vectors to train.
+    - "hnsw":    graph index (IndexHNSWFlat), ~log(N) search instead of a full scan;
+                 approximate, worth it once the corpus is large.
     """
     if embeddings.dtype != np.float32:
-        embeddings = embeddings.astype(np.float32)
+        raise ValueError(f"embeddings must be float32 (got {embeddings.dtype}); encode to FP32 upfront")
 
+    # In place (works on an np.memmap too): no second copy of the matrix
     faiss.normalize_L2(embeddings)
     d = embeddings.shape[1]
-    index = faiss.IndexFlatIP(d)  # inner product
+
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(d)  # inner product
+    elif index_type == "sq_fp16":
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+    elif index_type == "sq8":
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+    elif index_type == "pq":
+        if len(embeddings) < PQ_MIN_TRAIN:
+            raise ValueError(
+                f"index_type='pq' needs at least {PQ_MIN_TRAIN} vectors to train, got {len(embeddings)}; "
+                "use 'flat' or 'sq8' for small corpora"
+            )
+        # m sub-quantizers must divide d: largest divisor of d not above d // 4
+        m = next(m for m in range(max(d // 4, 1), 0, -1) if d % m == 0)
+        index = faiss.IndexPQ(d, m, PQ_NBITS, faiss.METRIC_INNER_PRODUCT)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(d, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    else:
+        raise ValueError(f"Unknown index_type: {index_type} (expected one of {INDEX_TYPES})")
+
+    if not index.is_trained:
+        index.train(embeddings)
     index.add(embeddings)
     return index
+
+
+def build_partitioned_index(
+    embeddings: np.ndarray,
+    pid_rows: Dict[str, np.ndarray],
+    index_type: str = "flat",
+) -> Dict[str, Tuple[faiss.Index, np.ndarray]]:
+    """
+    One small cosine index per patient: patient_id -> (sub-index, global row ids).
+    Sub-index row j is global row `ids[j]`, so a patient-filtered query only
+    scores that patient's vectors.
+    """
+    partitions = {}
+    for pid, rows in pid_rows.items():
+        if not pid:
+            continue
+        # Most patients have too few chunks to train PQ; their sub-index stays exact
+        sub_type = "flat" if index_type == "pq" and len(rows) < PQ_MIN_TRAIN else index_type
+        partitions[pid] = (build_cosine_faiss_index(embeddings[rows], index_type=sub_type), rows)
+    return partitions
+
+
+def partition_dir(index_path: str) -> Path:
+    return Path(index_path).parent / "partitions"
+
+
+def clear_partitions(index_path: str) -> None:
+    """
+    Remove previously written partitions, so a rebuild never leaves sub-indexes
+    whose row ids point into an older chunks file.
+    """
+    shutil.rmtree(partition_dir(index_path), ignore_errors=True)
+
+
+def save_partitioned_index(partitions: Dict[str, Tuple[faiss.Index, np.ndarray]], index_path: str) -> None:
+    clear_partitions(index_path)
+    out_dir = partition_dir(index_path)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for pid, (index, rows) in partitions.items():
+        faiss.write_index(index, str(out_dir / f"{pid}.faiss"))
+        np.save(out_dir / f"{pid}.ids.npy", rows)
+
+
+def load_patient_partition(
+    index_path: str,
+    patient_id: str,
+    chunks_path: Optional[str] = None,
+) -> Optional[Tuple[faiss.Index, np.ndarray]]:
+    """
+    Load one patient's sub-index and its global row ids, or None if the index
+    was built without partitions, or if the partition is older than the global
+    index (or the chunks file): its row ids would no longer match.
+    """
+    out_dir = partition_dir(index_path)
+    pid = patient_id.upper()
+    index_file = out_dir / f"{pid}.faiss"
+    ids_file = out_dir / f"{pid}.ids.npy"
+    if not index_file.exists() or not ids_file.exists():
+        return None
+
+    written = min(index_file.stat().st_mtime_ns, ids_file.stat().st_mtime_ns)
+    sources = [index_path] + ([chunks_path] if chunks_path else [])
+    if any(written < Path(p).stat().st_mtime_ns for p in sources if Path(p).exists()):
+        return None
+    return load_faiss_index(str(index_file)), np.load(ids_file)
+
+
+def alloc_search_buffers(n_queries: int, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Preallocated (D, I) output arrays, reusable across searches of the same shape
+    instead of letting the FAISS wrapper allocate fresh ones per call.
+    """
+    return (
+        np.empty((n_queries, top_k), dtype=np.float32),
+        np.empty((n_queries, top_k), dtype=np.int64),
+    )
+
+
+def search_subset(
+    index: faiss.Index,
+    q_emb: np.ndarray,
+    top_k: int,
+    candidates: np.ndarray,
+    buffers: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Search only among the given row ids by pushing an ID selector into FAISS,
+    so no distances are computed for other rows and the top-k is exact for the subset.
+    Indexes without selector support (PQ) fall back to `_search_subset_overfetch`.
+    Missing results are padded with id -1, as with a regular search.
+    `buffers` (from `alloc_search_buffers`) receive the results when given.
+    """
+    if isinstance(index, SELECTOR_UNSUPPORTED):
+        return _search_subset_overfetch(index, q_emb, top_k, candidates, buffers)
+
+    if isinstance(index, faiss.IndexHNSW) and len(candidates) <= HNSW_EXACT_SUBSET_MAX:
+        # A selective filter starves the HNSW beam of matching nodes: score small subsets exactly
+        return _search_subset_exact(index, q_emb, top_k, candidates, buffers)
+
+    D, I = buffers if buffers is not None else (None, None)
+    sel = faiss.IDSelectorBatch(np.ascontiguousarray(candidates, dtype=np.int64))
+    if isinstance(index, faiss.IndexHNSW):
+        # HNSW only accepts its own parameter type. The beam is widened by the
+        # filter's selectivity so it still meets ~efSearch matching nodes.
+        scale = -(-index.ntotal // max(len(candidates), 1))  # ceil
+        ef = min(max(index.hnsw.efSearch * scale, top_k), index.ntotal)
+        params = faiss.SearchParametersHNSW(sel=sel, efSearch=ef)
+    else:
+        params = faiss.SearchParameters(sel=sel)
+    return index.search(q_emb, top_k, params=params, D=D, I=I)
+
+
+def _search_subset_exact(
+    index: faiss.Index,
+    q_emb: np.ndarray,
+    top_k: int,
+    candidates: np.ndarray,
+    buffers: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Brute-force inner product over the reconstructed candidate vectors
+    (exact top-k for the subset, for any index that supports reconstruct).
+    """
+    D, I = buffers if buffers is not None else alloc_search_buffers(len(q_emb), top_k)
+    D.fill(-np.inf)
+    I.fill(-1)
+
+    candidates = np.asarray(candidates, dtype=np.int64)
+    if len(candidates) == 0:
+        return D, I
+
+    scores = q_emb @ index.reconstruct_batch(candidates).T  # (n_queries, n_candidates)
+    k = min(top_k, len(candidates))
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    D[:, :k] = np.take_along_axis(top_scores, order, axis=1)
+    I[:, :k] = candidates[np.take_along_axis(top, order, axis=1)]
+    return D, I
+
+
+def _search_subset_overfetch(
+    index: faiss.Index,
+    q_emb: np.ndarray,
+    top_k: int,
+    candidates: np.ndarray,
+    buffers: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Subset search without a selector: search a larger k and keep candidate ids,
+    doubling k until each query has top_k hits (or the whole index was searched).
+    """
+    D, I = buffers if buffers is not None else alloc_search_buffers(len(q_emb), top_k)
+    D.fill(-np.inf)
+    I.fill(-1)
+
+    candidates = np.asarray(candidates, dtype=np.int64)
+    want = min(top_k, len(candidates))
+    k = min(index.ntotal, max(top_k * 10, 50))
+    for qi in range(len(q_emb)):
+        while True:
+            scores, ids = index.search(q_emb[qi : qi + 1], k)
+            valid = ids[0] != -1  # padding repeats -1, which would break assume_unique
+            scores, ids = scores[0][valid], ids[0][valid]
+            # Vectorized membership (candidate rows are unique, as are returned ids)
+            mask = np.isin(ids, candidates, assume_unique=True)
+            hit_scores, hit_ids = scores[mask][:top_k], ids[mask][:top_k]
+            if len(hit_ids) >= want or k >= index.ntotal:
+                break
+            k = min(index.ntotal, k * 2)
+        D[qi, : len(hit_ids)] = hit_scores
+        I[qi, : len(hit_ids)] = hit_ids
+    return D, I
@@ -0,0 +1,118 @@
+from __future__ import annotations
+import argparse
+import sys
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import orjson
+import onnxruntime as ort
+from huggingface_hub import snapshot_download
+from transformers import AutoTokenizer
+
+
+# Sentences for the parity check against SentenceTransformer.encode
+PARITY_SENTENCES = [
+    "What adverse events are mentioned?",
+    "The patient received two cycles of carboplatin and paclitaxel.",
+    "No evidence of pneumonitis on the follow-up CT scan.",
+    "Grade 2 neutropenia resolved after dose reduction.",
+]
+
+
+def read_pooling_mode(model_dir: str) -> str:
+    """
+    Pooling of a SentenceTransformer model, from its `1_Pooling/config.json`: "mean" or "cls".
+    Raises ValueError for a missing config or any other mode, rather than silently
+    mean-pooling a model the index was not built with.
+    """
+    path = Path(model_dir) / "1_Pooling" / "config.json"
+    if not path.exists():
+        raise ValueError(f"No pooling config at {path}")
+    cfg = orjson.loads(path.read_bytes())
+    modes = sorted(k for k, v in cfg.items() if k.startswith("pooling_mode_") and v is True)
+    if modes == ["pooling_mode_mean_tokens"]:
+        return "mean"
+    if modes == ["pooling_mode_cls_token"]:
+        return "cls"
+    raise ValueError(f"Unsupported pooling {modes} in {path} (expected mean or cls)")
+
+
+class OnnxEncoder:
+    """
+    Sentence encoder running the ONNX export directly in ONNX Runtime:
+    fast tokenizer -> transformer -> mean pooling -> L2 norm, all in NumPy.
+    Matches the SentenceTransformer MiniLM pipeline without its per-call
+    collation/DataLoader overhead, which dominates single-query encoding.
+    The pooling mode is read from the model's `1_Pooling/config.json`; verify a
+    new model with `python -m src.retrieval.onnx_encoder --model ...` before use.
+    """
+
+    def __init__(self, model_dir: str, file_name: str = "onnx/model.onnx", max_length: int = 256):
+        self.pooling = read_pooling_mode(model_dir)
+        self.sess = ort.InferenceSession(
+            str(Path(model_dir) / file_name),
+            providers=["CPUExecutionProvider"],
+        )
+        self.tok = AutoTokenizer.from_pretrained(model_dir)
+        self.input_names = {i.name for i in self.sess.get_inputs()}
+        self.max_length = max_length
+
+    @classmethod
+    def from_pretrained(cls, model_name: str, file_name: str = "onnx/model.onnx") -> "OnnxEncoder":
+        """
+        Accept a local model directory or a Hugging Face repo id
+        (only the tokenizer/config files and the requested ONNX file are downloaded).
+        """
+        if Path(model_name).is_dir():
+            model_dir = model_name
+        else:
+            model_dir = snapshot_download(model_name, allow_patterns=[file_name, "*.json", "*.txt", "1_Pooling/*"])
+        return cls(model_dir, file_name=file_name)
+
+    def encode(self, sentences: List[str]) -> np.ndarray:
+        inputs = self.tok(
+            sentences,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="np",
+        )
+        feed = {k: v for k, v in inputs.items() if k in self.input_names}
+        token_emb = self.sess.run(None, feed)[0]
+
+        if self.pooling == "cls":
+            emb = token_emb[:, 0].copy()
+        else:
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            emb = (token_emb * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        emb /= np.linalg.norm(emb, axis=1, keepdims=True)
+        return emb.astype(np.float32)
+
+    def parity(self, model_name: str, sentences: List[str] = PARITY_SENTENCES) -> float:
+        """
+        Lowest cosine similarity between this encoder and SentenceTransformer.encode
+        (the encoder the index is built with) over `sentences`.
+        """
+        from sentence_transformers import SentenceTransformer
+
+        ref = SentenceTransformer(model_name).encode(sentences, normalize_embeddings=True)
+        return float(np.min(np.sum(self.encode(sentences) * ref, axis=1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the ONNX Runtime encoder against SentenceTransformer.encode.")
+    parser.add_argument("--model", type=str, default="sentence-transformers/all-MiniLM-L6-v2")
+    parser.add_argument("--file_name", type=str, default="onnx/model.onnx", help="ONNX file inside the model repo")
+    parser.add_argument("--min_cosine", type=float, default=0.99)
+    args = parser.parse_args()
+
+    cos = OnnxEncoder.from_pretrained(args.model, file_name=args.file_name).parity(args.model)
+    if cos < args.min_cosine:
+        print(f"❌ {args.model} ({args.file_name}): min cosine {cos:.4f} < {args.min_cosine}")
+        sys.exit(1)
+    print(f"✅ {args.model} ({args.file_name}): min cosine {cos:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,94 +1,213 @@
 from __future__ import annotations
 import argparse
-import json
+import os
+from dataclasses import dataclass, field
 from typing import List, Dict, Any, Optional
 
 import numpy as np
-from sentence_transformers import SentenceTransformer
+import orjson
+import requests
 import faiss
 
-from src.retrieval.faiss_store import load_faiss_index
+from src.retrieval.chunk_columns import ChunkColumns, load_or_build_columns, read_texts
+from src.retrieval.faiss_store import load_faiss_index, load_patient_partition, search_subset
+from src.retrieval.st_encoder import load_query_model
 
 
 def read_jsonl(path: str) -> List[Dict[str, Any]]:
-    items = []
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            items.append(json.loads(line))
-    return items
+    with open(path, "rb") as f:
+        # orjson takes the raw bytes and tolerates the trailing newline
+        return [orjson.loads(line) for line in f if not line.isspace()]
 
 
-def filter_candidates(items: List[Dict[str, Any]], patient_id: Optional[str]) -> np.ndarray:
+def filter_candidates(cols: ChunkColumns, patient_id: str) -> np.ndarray:
     """
-    Return indices of candidate chunks (row indices in items).
-    If patient_id is None -> all.
+    Return row indices of one patient's chunks: a vectorized compare over the
+    patient code column, no per-row Python work.
     """
-    if patient_id is None:
-        return np.arange(len(items), dtype=np.int64)
+    return cols.rows_for_patient(patient_id)
 
-    pid = patient_id.upper()
-    idx = [i for i, it in enumerate(items) if str(it.get("patient_id", "")).upper() == pid]
-    return np.array(idx, dtype=np.int64)
 
+@dataclass
+class SearchContext:
+    """
+    Everything a search needs, loaded once (per CLI run, or once per server process).
+    """
+    cols: ChunkColumns
+    chunks_path: str
+    index_path: str
+    model: Any
+    batch_size: int = 32
+    index: Optional[faiss.Index] = None
+    partitions: Dict[str, Any] = field(default_factory=dict)
 
-def main():
-    parser = argparse.ArgumentParser(description="Search FAISS index with optional patient_id filter")
+
+def add_search_args(parser: argparse.ArgumentParser) -> None:
     parser.add_argument("--index", type=str, default="indices/faiss/index.faiss")
     parser.add_argument("--chunks", type=str, default="data/processed/chunks.jsonl")
     parser.add_argument("--model", type=str, default="sentence-transformers/all-MiniLM-L6-v2")
-    parser.add_argument("--question", type=str, required=True)
-    parser.add_argument("--top_k", type=int, default=5)
-    parser.add_argument("--patient_id", type=str, default=None, help="Optional patient filter, e.g., P001")
-    args = parser.parse_args()
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=min(os.cpu_count() or 1, 8), help="Torch / FAISS (OpenMP) threads")
 
-    items = read_jsonl(args.chunks)
-    index = load_faiss_index(args.index)
 
-    model = SentenceTransformer(args.model)
-
-    q = args.question
-    q_emb = model.encode([q], convert_to_numpy=True).astype(np.float32)
+def encode_questions(model: Any, questions: List[str], batch_size: int = 32) -> np.ndarray:
+    """
+    L2-normalized FP32 query embeddings, one row per question.
+    """
+    emb = model.encode(questions, batch_size=batch_size, convert_to_tensor=True)
+    q_emb = np.ascontiguousarray(emb.float().cpu().numpy())
     faiss.normalize_L2(q_emb)  # for cosine with inner product
+    return q_emb
+
+
+def load_search_context(args: argparse.Namespace) -> SearchContext:
+    import torch
+
+    # Past ~8 threads encode and flat search stop scaling; default is min(cpu_count, 8)
+    torch.set_num_threads(args.threads)
+    faiss.omp_set_num_threads(args.threads)
+
+    return SearchContext(
+        cols=load_or_build_columns(args.chunks),
+        chunks_path=args.chunks,
+        index_path=args.index,
+        model=load_query_model(args.model),
+        batch_size=args.batch_size,
+    )
+
+
+def _global_index(ctx: SearchContext) -> faiss.Index:
+    if ctx.index is None:
+        ctx.index = load_faiss_index(ctx.index_path)
+    return ctx.index
+
+
+def _partition(ctx: SearchContext, patient_id: str) -> Any:
+    pid = patient_id.upper()
+    if pid not in ctx.partitions:
+        ctx.partitions[pid] = load_patient_partition(ctx.index_path, pid, ctx.chunks_path)
+    return ctx.partitions[pid]
+
+
+def search_questions(
+    ctx: SearchContext,
+    questions: List[str],
+    patient_id: Optional[str] = None,
+    top_k: int = 5,
+) -> List[List[Dict[str, Any]]]:
+    """
+    Top-k hits for each question (one batched encode + one FAISS search).
+    Each hit: row, score, patient_id, doc_id, page, chunk_id, text.
+    """
+    # All questions in one encode call and one FAISS search (row j = question j)
+    q_emb = encode_questions(ctx.model, questions, batch_size=ctx.batch_size)
 
     # If no filter: standard search
-    if args.patient_id is None:
-        scores, ids = index.search(q_emb, args.top_k)
-        scores = scores[0]
-        ids = ids[0]
-        results = [(int(i), float(s)) for i, s in zip(ids, scores) if i != -1]
+    if patient_id is None:
+        scores, ids = _global_index(ctx).search(q_emb, top_k)
+    else:
+        partition = _partition(ctx, patient_id)
+        if partition is not None:
+            # Partitioned index: search only this patient's sub-index, map back to global rows
+            sub_index, rows = partition
+            scores, local_ids = sub_index.search(q_emb, top_k)
+            ids = np.where(local_ids != -1, rows[local_ids], -1)
+        else:
+            # Patient filter: restrict the global search to the patient's ids (IDSelector)
+            candidates = filter_candidates(ctx.cols, patient_id)
+            if len(candidates) == 0:
+                return [[] for _ in questions]
+            scores, ids = search_subset(_global_index(ctx), q_emb, top_k, candidates)
+
+    cols = ctx.cols
+    results = []
+    for q_scores, q_ids in zip(scores, ids):
+        hits = [(int(i), float(s)) for i, s in zip(q_ids, q_scores) if i != -1]
+        # Only the final top-k texts are read from the JSONL
+        texts = read_texts(ctx.chunks_path, cols.offsets[[row for row, _ in hits]])
+        results.append([
+            {
+                "row": row,
+                "score": score,
+                "patient_id": cols.patient_id(row),
+                "doc_id": str(cols.doc_ids[row]),
+                "page": int(cols.pages[row]),
+                "chunk_id": int(cols.chunk_ids[row]),
+                "text": text,
+            }
+            for (row, score), text in zip(hits, texts)
+        ])
+    return results
+
+
+def search_remote(
+    server_url: str,
+    questions: List[str],
+    patient_id: Optional[str] = None,
+    top_k: int = 5,
+) -> List[List[Dict[str, Any]]]:
+    """
+    Same as search_questions, against a running `src.retrieval.server` (model already loaded).
+    Raises LookupError when the server has no chunks for `patient_id`.
+    """
+    resp = requests.post(
+        f"{server_url.rstrip('/')}/search",
+        json={"questions": questions, "patient_id": patient_id, "top_k": top_k},
+        timeout=120,
+    )
+    if resp.status_code == 404:
+        # e.g. unknown patient_id: surface the server's message
+        raise LookupError(resp.json().get("error", resp.text))
+    resp.raise_for_status()
+    return resp.json()["results"]
+
+
+def print_results(questions: List[str], results: List[List[Dict[str, Any]]], patient_id: Optional[str]) -> None:
+    for q, hits in zip(questions, results):
+        print("\nQUESTION:", q)
+        if patient_id:
+            print("PATIENT FILTER:", patient_id.upper())
+
+        for rank, hit in enumerate(hits, 1):
+            print(f"\n--- Rank {rank} | score={hit['score']:.4f} | patient={hit['patient_id']} | doc={hit['doc_id']} | page={hit['page']} | chunk_id={hit['chunk_id']} ---")
+            print(hit["text"])
+
+
+def read_questions(path: str) -> List[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search FAISS index with optional patient_id filter")
+    add_search_args(parser)
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--question", type=str)
+    group.add_argument("--questions_file", type=str, help="Text file with one question per line (batched encode + search)")
+    parser.add_argument("--top_k", type=int, default=5)
+    parser.add_argument("--patient_id", type=str, default=None, help="Optional patient filter, e.g., P001")
+    parser.add_argument("--server", type=str, default=None, help="URL of a running search server, e.g. http://127.0.0.1:8765")
+    args = parser.parse_args()
+
+    questions = [args.question] if args.question else read_questions(args.questions_file)
+    if not questions:
+        print(f"❌ No questions in {args.questions_file}")
+        return
+
+    if args.server:
+        try:
+            results = search_remote(args.server, questions, args.patient_id, args.top_k)
+        except LookupError as e:
+            print(f"❌ {e}")
+            return
     else:
-        # Patient filter: search more, then filter
-        candidates = filter_candidates(items, args.patient_id)
-        if len(candidates) == 0:
+        ctx = load_search_context(args)
+        if args.patient_id and len(filter_candidates(ctx.cols, args.patient_id)) == 0:
             print(f"❌ No chunks found for patient_id={args.patient_id}")
             return
+        results = search_questions(ctx, questions, args.patient_id, args.top_k)
 
-        # Strategy: search a larger K then filter (simple + effective)
-        big_k = min(len(items), max(args.top_k * 10, 50))
-        scores, ids = index.search(q_emb, big_k)
-        scores = scores[0]
-        ids = ids[0]
-
-        filtered = []
-        cand_set = set(candidates.tolist())
-        for i, s in zip(ids, scores):
-            if int(i) in cand_set:
-                filtered.append((int(i), float(s)))
-            if len(filtered) >= args.top_k:
-                break
-        results = filtered
-
-    print("\nQUESTION:", q)
-    if args.patient_id:
-        print("PATIENT FILTER:", args.patient_id.upper())
-
-    for rank, (row_idx, score) in enumerate(results, 1):
-        it = items[row_idx]
-        print(f"\n--- Rank {rank} | score={score:.4f} | patient={it.get('patient_id')} | doc={it.get('doc_id')} | page={it.get('page')} | chunk_id={it.get('chunk_id')} ---")
-        print(it["text"])
+    print_results(questions, results, args.patient_id)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,104 @@
+from __future__ import annotations
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+import orjson
+
+from src.retrieval.search import (
+    SearchContext,
+    add_search_args,
+    filter_candidates,
+    load_search_context,
+    search_questions,
+)
+
+
+def parse_search_request(body: bytes) -> Tuple[List[str], Optional[str], int]:
+    """
+    Validate a POST /search body: {"questions": [str, ...]} or {"question": str},
+    optional "patient_id" (str) and "top_k" (int >= 1). Raises ValueError.
+    """
+    req = orjson.loads(body)
+    if not isinstance(req, dict):
+        raise ValueError("body must be a JSON object")
+
+    questions = req.get("questions")
+    if questions is None and "question" in req:
+        questions = [req["question"]]
+    if not isinstance(questions, list) or not questions or not all(isinstance(q, str) and q.strip() for q in questions):
+        raise ValueError("'questions' must be a non-empty list of non-empty strings (or give 'question')")
+
+    patient_id = req.get("patient_id")
+    if patient_id is not None and not isinstance(patient_id, str):
+        raise ValueError("'patient_id' must be a string")
+
+    top_k = req.get("top_k", 5)
+    if isinstance(top_k, bool) or not isinstance(top_k, int) or top_k < 1:
+        raise ValueError("'top_k' must be an integer >= 1")
+
+    return questions, patient_id, top_k
+
+
+def make_handler(ctx: SearchContext) -> Type[BaseHTTPRequestHandler]:
+    # One search at a time: encode/search already use all configured threads
+    lock = threading.Lock()
+
+    class SearchHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+            body = orjson.dumps(payload)
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self) -> None:
+            if self.path != "/search":
+                self._send_json(404, {"error": f"Unknown path: {self.path}"})
+                return
+
+            try:
+                questions, patient_id, top_k = parse_search_request(
+                    self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                )
+            except (orjson.JSONDecodeError, ValueError) as e:
+                self._send_json(400, {"error": f"Bad request: {e}"})
+                return
+
+            if patient_id and len(filter_candidates(ctx.cols, patient_id)) == 0:
+                self._send_json(404, {"error": f"No chunks found for patient_id={patient_id}"})
+                return
+
+            try:
+                with lock:
+                    results = search_questions(ctx, questions, patient_id, top_k)
+            except Exception as e:
+                self._send_json(500, {"error": f"Search failed: {type(e).__name__}: {e}"})
+                return
+            self._send_json(200, {"results": results})
+
+    return SearchHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve FAISS search over HTTP (model + index loaded once).")
+    add_search_args(parser)
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    ctx = load_search_context(args)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(ctx))
+    print(f"✅ Search server on http://{args.host}:{args.port} (POST /search)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
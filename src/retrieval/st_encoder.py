@@ -0,0 +1,19 @@
+from __future__ import annotations
+from typing import Any
+
+
+def load_query_model(model_name: str) -> Any:
+    """
+    SentenceTransformer query encoder; on a CUDA host the weights are cast to FP16
+    (about 2x less transformer compute and memory). Embeddings are cast back to
+    FP32 for FAISS.
+    torch / sentence-transformers are imported here, so callers that never build
+    a model (e.g. the search client in --server mode) don't pay for them.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name)
+    if torch.cuda.is_available():
+        model.half()
+    return model